@@ -1,11 +1,30 @@
-from fastapi import FastAPI, UploadFile
-from pydantic import BaseModel
+import asyncio
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
+import msgspec
+from fastapi import FastAPI, Response, UploadFile
+from pydantic import TypeAdapter
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+
+from src.driver import extract_features_batch, stream_features
+from src.extractor import Features
+from src.llm import close_model, get_tokenizer
+
+
+# serializes straight to JSON bytes in pydantic-core, skipping jsonable_encoder and the stdlib json module
+_features_list = TypeAdapter(List[Optional[Features]])
 
-from src.driver import extract_features
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await asyncio.to_thread(get_tokenizer)
+    yield
+    await close_model()
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -17,7 +36,20 @@ app.add_middleware(
 
 @app.post("/")
 async def fun(file: UploadFile):
-    features: BaseModel = extract_features(file.file)
-    return features.model_dump()
+    content = await file.read()
+
+    # one {"actions": {...}} / {"info_": {...}} line per item; each call's items are flushed
+    # together when its tool call arrives, so a region's actions reach the client before its info
+    async def _gen():
+        async for field, item in stream_features(content):
+            yield msgspec.json.encode({field: item}) + b'\n'
+
+    return StreamingResponse(_gen(), media_type="application/x-ndjson")
+
+@app.post("/batch")
+async def fun_batch(files: List[UploadFile]):
+    contents = [await file.read() for file in files]
+    features: List[Optional[Features]] = await extract_features_batch(contents)
+    return Response(_features_list.dump_json(features), media_type="application/json")
 
 # Created By Amit Mahapatra
\ No newline at end of file
@@ -1,70 +1,448 @@
+import asyncio
+import hashlib
+import os
+import re
+import tempfile
+from contextlib import aclosing
+from pathlib import Path
+
+import msgspec
+from bs4 import BeautifulSoup, Comment
 from httpcore import __name
-from transformers import AutoTokenizer
-
-from src.extractor import bmodel
-
-
-def extract_features(file):
-    tokenizer = AutoTokenizer.from_pretrained("openai/gpt-oss-120b")
-    content = file.read()
-
-    # tokens = tokenizer.encode(content)
-
-    result = bmodel.invoke(
-        f"""
-            Role: UI Feature Analyzer
-            Context: You are an expert AI model designed to parse raw HTML content and strictly categorize its visible features as either interactive actions or read-only information, mimicking the perception of a human viewing the rendered web page.
-
-            Thought Process (Internal to the LLM):
-            1.  **Analyze Actions:** Identify and group related interactive elements (forms, buttons, links) into single logical **Actions**. Ensure the Action's `process` describes the full sequential interaction path.
-            2.  **Analyze Information:** Identify all static, read-only text content.
-            3.  **Group Information (NEW):** Combine related data points, labels, and statistics into **ONE** cohesive, descriptive statement. For instance, combine "John Doe", "User Profile is", and "Frontend Engineer" into a single summary statement. Combine a metric's label, its value, and its change percentage into one comprehensive entry.
-            4.  **Filter Redundancy:** Strictly filter this content: If any text, label, or UI element has been included in the `actions` list (even if it's a placeholder or label), it **MUST BE EXCLUDED** from the `info_` list.
-            5.  **Format:** Format the grouped, filtered results into the required `Features` tool call.
-
-            Task:
-            Analyze the provided raw HTML content to identify all elements that would be visible in a rendered web browser, classifying them as the site's Features.
-            1.  **Actions:** Identify all interactive features. All fields, toggles, and buttons belonging to a single goal must be combined into **ONE** Action.
-            2.  **Information (info_):** Identify all static, read-only content. **All related data, labels, and metrics must be grouped into a single, comprehensive, human-readable sentence** that summarizes the displayed information (e.g., combining a KPI's value and its label).
-
-            Constraints:
-            * **STRICTLY UI-BASED:** Base all findings exclusively on what is visible in the rendered UI.
-            * **NO INFERENCE:** Do not infer any backend logic or invisible behavior.
-            * **GROUPING (ACTIONS):** All components of a single form or interactive goal MUST be grouped into **ONE** single `Action`.
-            * **GROUPING (INFO):** Related data points (like a statistic and its label) must be grouped into a **single, descriptive, human-readable sentence** in the `description` field of the `Info` model. Do not list fragments.
-            * **REDUNDANCY:** Any text, label, or UI element that is part of an identified `Action` **MUST NOT** be included in the `info_` list.
-            * **CRITICAL OUTPUT RULE:** You must format the final analysis using the provided tool/function **Features**. The analysis is useless if not structured this way.
-            * **NO OMISSION:** All fields must be present. If no Actions or Information are found, return the corresponding list as empty (`[]`).
-
-            Output Format:
-            * **MANDATORY TOOL CALL:** You MUST output **ONLY** a single tool call to the **Features** function.
-            * **ABSOLUTE RULE:** Absolutely no commentary, reasoning, markdown, or text **before, after, or outside** the `Features` tool call. This is a machine-readable requirement.
-            * The output structure must exactly match the `Features` schema.
-
-            Examples:
-            HTML Content Snippet: (Dashboard Example)
-
-            Example Action (Grouped):
-                - description: "Filter Dashboard Data by Date Range"
-                - process: "Click the dropdown or input field showing '12.04.2023 - 12.05.2024' to open the date picker, select a new start and end date, and click 'Apply'."
-
-            Example Information (Grouped and Human-Readable):
-                - description: "The current user is John Doe, whose profile title is Frontend Engineer."
-                - description: "The Dashboard Overview shows Total Views are $3,456K, which is up 0.43%."
-                - description: "The Total Sales metric for the period 12.04.2023 - 12.05.2024 is currently displayed."
-                - description: "The company's brand or product name displayed in the header is Zenith (Z)."
-
-            HTML CONTENT:
-            {content}
-        """
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from src.extractor import Action, Features, Info, amodel, imodel
+from src.llm import MODEL_NAME, get_tokenizer
+
+
+# bump whenever the prompt or the HTML preprocessing changes so cached results are not reused
+PROMPT_VERSION = '3'
+_CACHE_DIR = Path('.feat_cache')
+# least recently used entries beyond this are evicted on write
+_CACHE_MAX_ENTRIES = 1024
+
+# single-call prompt, only used by the STRICT trustcall path
+_PROMPT_PREFIX = """
+Role: UI Feature Analyzer
+Context: You are an expert AI model designed to parse raw HTML content and strictly categorize its visible features as either interactive actions or read-only information, mimicking the perception of a human viewing the rendered web page.
+
+Thought Process (Internal to the LLM):
+1.  **Analyze Actions:** Identify and group related interactive elements (forms, buttons, links) into single logical **Actions**. Ensure the Action's `process` describes the full sequential interaction path.
+2.  **Analyze Information:** Identify all static, read-only text content.
+3.  **Group Information (NEW):** Combine related data points, labels, and statistics into **ONE** cohesive, descriptive statement. For instance, combine "John Doe", "User Profile is", and "Frontend Engineer" into a single summary statement. Combine a metric's label, its value, and its change percentage into one comprehensive entry.
+4.  **Filter Redundancy:** Strictly filter this content: If any text, label, or UI element has been included in the `actions` list (even if it's a placeholder or label), it **MUST BE EXCLUDED** from the `info_` list.
+5.  **Format:** Format the grouped, filtered results into the required `Features` tool call.
+
+Task:
+Analyze the provided raw HTML content to identify all elements that would be visible in a rendered web browser, classifying them as the site's Features.
+1.  **Actions:** Identify all interactive features. All fields, toggles, and buttons belonging to a single goal must be combined into **ONE** Action.
+2.  **Information (info_):** Identify all static, read-only content. **All related data, labels, and metrics must be grouped into a single, comprehensive, human-readable sentence** that summarizes the displayed information (e.g., combining a KPI's value and its label).
+
+Constraints:
+* **STRICTLY UI-BASED:** Base all findings exclusively on what is visible in the rendered UI.
+* **NO INFERENCE:** Do not infer any backend logic or invisible behavior.
+* **GROUPING (ACTIONS):** All components of a single form or interactive goal MUST be grouped into **ONE** single `Action`.
+* **GROUPING (INFO):** Related data points (like a statistic and its label) must be grouped into a **single, descriptive, human-readable sentence** in the `description` field of the `Info` model. Do not list fragments.
+* **REDUNDANCY:** Any text, label, or UI element that is part of an identified `Action` **MUST NOT** be included in the `info_` list.
+* **CRITICAL OUTPUT RULE:** You must format the final analysis using the provided tool/function **Features**. The analysis is useless if not structured this way.
+* **NO OMISSION:** All fields must be present. If no Actions or Information are found, return the corresponding list as empty (`[]`).
+
+Output Format:
+* **MANDATORY TOOL CALL:** You MUST output **ONLY** a single tool call to the **Features** function.
+* **ABSOLUTE RULE:** Absolutely no commentary, reasoning, markdown, or text **before, after, or outside** the `Features` tool call. This is a machine-readable requirement.
+* The output structure must exactly match the `Features` schema.
+
+Examples:
+HTML Content Snippet: (Dashboard Example)
+
+Example Action (Grouped):
+    - description: "Filter Dashboard Data by Date Range"
+    - process: "Click the dropdown or input field showing '12.04.2023 - 12.05.2024' to open the date picker, select a new start and end date, and click 'Apply'."
+
+Example Information (Grouped and Human-Readable):
+    - description: "The current user is John Doe, whose profile title is Frontend Engineer."
+    - description: "The Dashboard Overview shows Total Views are $3,456K, which is up 0.43%."
+    - description: "The Total Sales metric for the period 12.04.2023 - 12.05.2024 is currently displayed."
+    - description: "The company's brand or product name displayed in the header is Zenith (Z)."
+"""
+
+_ACTIONS_PROMPT = """
+Role: UI Action Analyzer
+Context: You are an expert AI model designed to parse raw HTML content and identify the interactive actions a human can perform on the rendered web page.
+
+Thought Process (Internal to the LLM):
+1.  **Analyze Actions:** Identify and group related interactive elements (forms, buttons, links) into single logical **Actions**. Ensure the Action's `process` describes the full sequential interaction path.
+2.  **Format:** Format the grouped results into the required `ActionsOnly` tool call.
+
+Task:
+Analyze the provided raw HTML content to identify all interactive features that would be visible in a rendered web browser. All fields, toggles, and buttons belonging to a single goal must be combined into **ONE** Action.
+
+Constraints:
+* **STRICTLY UI-BASED:** Base all findings exclusively on what is visible in the rendered UI.
+* **NO INFERENCE:** Do not infer any backend logic or invisible behavior.
+* **GROUPING (ACTIONS):** All components of a single form or interactive goal MUST be grouped into **ONE** single `Action`.
+* **CRITICAL OUTPUT RULE:** You must format the final analysis using the provided tool/function **ActionsOnly**. The analysis is useless if not structured this way.
+* **NO OMISSION:** If no Actions are found, return the list as empty (`[]`).
+
+Output Format:
+* **MANDATORY TOOL CALL:** You MUST output **ONLY** a single tool call to the **ActionsOnly** function.
+* **ABSOLUTE RULE:** Absolutely no commentary, reasoning, markdown, or text **before, after, or outside** the `ActionsOnly` tool call. This is a machine-readable requirement.
+* The output structure must exactly match the `ActionsOnly` schema.
+
+Examples:
+HTML Content Snippet: (Dashboard Example)
+
+Example Action (Grouped):
+    - description: "Filter Dashboard Data by Date Range"
+    - process: "Click the dropdown or input field showing '12.04.2023 - 12.05.2024' to open the date picker, select a new start and end date, and click 'Apply'."
+"""
+
+_INFO_PROMPT = """
+Role: UI Information Analyzer
+Context: You are an expert AI model designed to parse raw HTML content and identify the read-only information a human sees on the rendered web page.
+
+Thought Process (Internal to the LLM):
+1.  **Analyze Information:** Identify all static, read-only text content.
+2.  **Group Information:** Combine related data points, labels, and statistics into **ONE** cohesive, descriptive statement. For instance, combine "John Doe", "User Profile is", and "Frontend Engineer" into a single summary statement. Combine a metric's label, its value, and its change percentage into one comprehensive entry.
+3.  **Filter Redundancy:** Strictly filter this content: If any text, label, or UI element belongs to one of the ALREADY IDENTIFIED ACTIONS (even if it's a placeholder or label), it **MUST BE EXCLUDED**.
+4.  **Format:** Format the grouped, filtered results into the required `InfoOnly` tool call.
+
+Task:
+Analyze the provided raw HTML content to identify all static, read-only content that would be visible in a rendered web browser. **All related data, labels, and metrics must be grouped into a single, comprehensive, human-readable sentence** that summarizes the displayed information (e.g., combining a KPI's value and its label).
+
+Constraints:
+* **STRICTLY UI-BASED:** Base all findings exclusively on what is visible in the rendered UI.
+* **NO INFERENCE:** Do not infer any backend logic or invisible behavior.
+* **GROUPING (INFO):** Related data points (like a statistic and its label) must be grouped into a **single, descriptive, human-readable sentence** in the `description` field of the `Info` model. Do not list fragments.
+* **REDUNDANCY:** Any text, label, or UI element that is part of an ALREADY IDENTIFIED ACTION **MUST NOT** be included in the `info_` list.
+* **CRITICAL OUTPUT RULE:** You must format the final analysis using the provided tool/function **InfoOnly**. The analysis is useless if not structured this way.
+* **NO OMISSION:** If no Information is found, return the list as empty (`[]`).
+
+Output Format:
+* **MANDATORY TOOL CALL:** You MUST output **ONLY** a single tool call to the **InfoOnly** function.
+* **ABSOLUTE RULE:** Absolutely no commentary, reasoning, markdown, or text **before, after, or outside** the `InfoOnly` tool call. This is a machine-readable requirement.
+* The output structure must exactly match the `InfoOnly` schema.
+
+Examples:
+HTML Content Snippet: (Dashboard Example)
+
+Example Information (Grouped and Human-Readable):
+    - description: "The current user is John Doe, whose profile title is Frontend Engineer."
+    - description: "The Dashboard Overview shows Total Views are $3,456K, which is up 0.43%."
+    - description: "The Total Sales metric for the period 12.04.2023 - 12.05.2024 is currently displayed."
+    - description: "The company's brand or product name displayed in the header is Zenith (Z)."
+"""
+
+# elements that never render as visible UI
+_STRIP_TAGS = ['script', 'style', 'noscript', 'svg', 'template']
+# inline styles that keep an element from rendering
+_HIDDEN_STYLE = re.compile(r'display\s*:\s*none|visibility\s*:\s*hidden', re.IGNORECASE)
+# attributes that carry what a human sees or interacts with
+_KEEP_ATTRIBUTES = {
+    'alt', 'aria-label', 'checked', 'disabled', 'for', 'href', 'name',
+    'placeholder', 'role', 'selected', 'title', 'type', 'value'
+}
+# top-level page landmarks extracted in parallel on large pages
+_REGION_TAGS = ['header', 'nav', 'main', 'aside', 'footer']
+# smaller pages stay a single call
+_REGION_SPLIT_TOKENS = 8_000
+# used to estimate token counts when the tokenizer is unavailable
+_CHARS_PER_TOKEN = 4
+# minified HTML can tokenize below 3 characters per token, so fallback truncation assumes 2
+_TRUNCATE_CHARS_PER_TOKEN = 2
+# hard cap on HTML tokens per call, leaving room in gpt-oss's 128k context for the prompt and output
+_TOKEN_BUDGET = 96_000
+
+
+def _is_hidden(tag):
+    return (
+        tag.has_attr('hidden')
+        or str(tag.get('aria-hidden', '')).lower() == 'true'
+        or (tag.name == 'input' and str(tag.get('type', '')).lower() == 'hidden')
+        or bool(_HIDDEN_STYLE.search(str(tag.get('style', ''))))
+    )
+
+
+def _minify_html(content):
+    """
+    Strips non-rendered markup (scripts, styles, comments, SVG paths, hidden
+    elements) and presentational attributes, then collapses whitespace, so the
+    prompt only carries what is visible in the rendered page.
+    """
+    soup = BeautifulSoup(content, 'html.parser')
+    for tag in soup(_STRIP_TAGS):
+        tag.decompose()
+    # must run before attributes are stripped, since they are what marks the element as hidden
+    for tag in soup.find_all(_is_hidden):
+        if not tag.decomposed:
+            tag.decompose()
+    for comment in soup.find_all(string=lambda text: isinstance(text, Comment)):
+        comment.extract()
+    for tag in soup.find_all(True):
+        tag.attrs = {key: value for key, value in tag.attrs.items() if key in _KEEP_ATTRIBUTES}
+
+    root = soup.body or soup
+    return re.sub(r'\s+', ' ', str(root)).strip()
+
+
+def _split_regions(content):
+    """
+    Splits minified HTML into its outermost landmark regions plus whatever
+    visible content is left outside them. Returns the page unchanged when it
+    has fewer than two landmarks.
+    """
+    soup = BeautifulSoup(content, 'html.parser')
+    regions = [
+        region for region in soup.find_all(_REGION_TAGS)
+        if region.find_parent(_REGION_TAGS) is None
+    ]
+    if len(regions) < 2:
+        return [content]
+
+    for region in regions:
+        region.extract()
+    chunks = [str(region) for region in regions]
+    if soup.get_text(strip=True):
+        chunks.append(str(soup))
+    return chunks
+
+
+def _construct_features(data):
+    # the tool call is schema-constrained, so skip field-by-field validation
+    return Features.model_construct(
+        actions=[Action.model_construct(**action) for action in data.get('actions', [])],
+        info_=[Info.model_construct(**info) for info in data.get('info_', [])]
     )
 
-    features = result['responses'][0] if result['responses'] else None
-    return features
+
+def _prompt_for(prompt, content, actions=None):
+    message = f"HTML CONTENT:\n{content}"
+    if actions is not None:
+        identified = '\n'.join(
+            f"- {action.get('description', '')}: {action.get('process', '')}" for action in actions
+        )
+        message += f"\n\nALREADY IDENTIFIED ACTIONS:\n{identified or '(none)'}"
+    return [SystemMessage(prompt), HumanMessage(message)]
+
+
+async def _call_tool(bound_model, messages, field):
+    """
+    Returns the `field` list from the model's tool call, or None if it made no
+    tool call. ChatOllama delivers each tool call whole, with its arguments
+    already parsed, so we stop reading the stream as soon as one arrives.
+    """
+    # aclosing cancels the underlying HTTP stream as soon as we stop iterating
+    async with aclosing(bound_model.astream(messages)) as stream:
+        async for chunk in stream:
+            if chunk.tool_calls:
+                return chunk.tool_calls[0]['args'].get(field, [])
+    return None
+
+
+async def _stream_region(content):
+    """
+    Yields (field, item) pairs for one region as each call returns, followed
+    by (None, None) once both the actions and the info calls are complete.
+    Actions are extracted first so the info call can be told what to exclude.
+    """
+    if os.environ.get('STRICT') == '1':
+        # only defined when STRICT is set at import time
+        from src.extractor import bmodel
+
+        features = await bmodel.ainvoke([
+            SystemMessage(_PROMPT_PREFIX),
+            HumanMessage(f"HTML CONTENT:\n{content}")
+        ])
+        if features is None:
+            return
+        for action in features.actions:
+            yield 'actions', action.model_dump()
+        for info in features.info_:
+            yield 'info_', info.model_dump()
+        yield None, None
+        return
+
+    actions = await _call_tool(amodel, _prompt_for(_ACTIONS_PROMPT, content), 'actions')
+    for action in actions or []:
+        yield 'actions', action
+
+    info_ = await _call_tool(imodel, _prompt_for(_INFO_PROMPT, content, actions or []), 'info_')
+    for info in info_ or []:
+        yield 'info_', info
+
+    if actions is not None and info_ is not None:
+        yield None, None
+
+
+_STREAM_DONE = object()
+
+
+async def _merge_streams(streams):
+    if len(streams) == 1:
+        async for entry in streams[0]:
+            yield entry
+        return
+
+    queue = asyncio.Queue()
+
+    async def pump(stream):
+        try:
+            async for entry in stream:
+                await queue.put(entry)
+            await queue.put(_STREAM_DONE)
+        except Exception as error:
+            await queue.put(error)
+
+    tasks = [asyncio.create_task(pump(stream)) for stream in streams]
+    try:
+        pending = len(tasks)
+        while pending:
+            entry = await queue.get()
+            if entry is _STREAM_DONE:
+                pending -= 1
+            elif isinstance(entry, Exception):
+                raise entry
+            else:
+                yield entry
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def _cache_path(raw):
+    digest = hashlib.blake2b(raw, digest_size=16)
+    digest.update(f'{MODEL_NAME}:{PROMPT_VERSION}'.encode())
+    return _CACHE_DIR / f'{digest.hexdigest()}.json'
+
+
+def _read_cache(path):
+    # an entry evicted by a concurrent writer at any point here is just a miss
+    try:
+        cached = path.read_bytes()
+        # reads refresh the mtime, so eviction drops the least recently used entries
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    return msgspec.json.decode(cached)
+
+
+def _cache_mtime(entry):
+    try:
+        return entry.stat().st_mtime
+    except FileNotFoundError:
+        return 0
+
+
+def _write_cache(path, data):
+    _CACHE_DIR.mkdir(exist_ok=True)
+    # a unique temp file per writer, so concurrent writes of the same key cannot collide
+    temp_file = tempfile.NamedTemporaryFile(dir=_CACHE_DIR, suffix='.tmp', delete=False)
+    try:
+        with temp_file:
+            temp_file.write(msgspec.json.encode(data))
+        os.replace(temp_file.name, path)
+    except BaseException:
+        Path(temp_file.name).unlink(missing_ok=True)
+        raise
+
+    entries = list(_CACHE_DIR.glob('*.json'))
+    if len(entries) > _CACHE_MAX_ENTRIES:
+        entries.sort(key=_cache_mtime)
+        for entry in entries[:len(entries) - _CACHE_MAX_ENTRIES]:
+            entry.unlink(missing_ok=True)
+
+
+def _count_tokens(content):
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        return len(content) // _CHARS_PER_TOKEN
+    return len(tokenizer.encode(content, add_special_tokens=False))
+
+
+def _truncate_to_budget(content):
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        return content[:_TOKEN_BUDGET * _TRUNCATE_CHARS_PER_TOKEN]
+    ids = tokenizer.encode(content, add_special_tokens=False)
+    if len(ids) <= _TOKEN_BUDGET:
+        return content
+    return tokenizer.decode(ids[:_TOKEN_BUDGET])
+
+
+def _prepare_regions(raw):
+    content = _minify_html(raw)
+    if _count_tokens(content) <= _REGION_SPLIT_TOKENS:
+        return [content]
+    return [_truncate_to_budget(region) for region in _split_regions(content)]
+
+
+async def _stream_merged(raw):
+    """
+    Yields ('actions' | 'info_', item) pairs as each region's tool calls return,
+    dropping duplicates across regions, plus one (None, None) per region whose
+    calls completed (a single one for a cache hit).
+    """
+    # STRICT regression runs always go to the model
+    use_cache = os.environ.get('STRICT') != '1'
+    cache_path = _cache_path(raw)
+    cached = await asyncio.to_thread(_read_cache, cache_path) if use_cache else None
+    if cached is not None:
+        for field in ('actions', 'info_'):
+            for item in cached[field]:
+                yield field, item
+        yield None, None
+        return
+
+    # HTML parsing and disk I/O run in worker threads so the event loop keeps serving other requests
+    regions = await asyncio.to_thread(_prepare_regions, raw)
+
+    data = {'actions': [], 'info_': []}
+    seen = set()
+    completed_regions = 0
+    async for field, item in _merge_streams([_stream_region(region) for region in regions]):
+        if field is None:
+            completed_regions += 1
+            yield None, None
+            continue
+        key = (field, item.get('description'), item.get('process'))
+        if key in seen:
+            continue
+        seen.add(key)
+        data[field].append(item)
+        yield field, item
+
+    # a region whose model call made no tool call is missing items, so never cache a partial result
+    if use_cache and completed_regions == len(regions):
+        await asyncio.to_thread(_write_cache, cache_path, data)
+
+
+async def stream_features(raw):
+    """
+    Yields ('actions' | 'info_', item) pairs as each region's tool calls return,
+    dropping duplicates across regions.
+    """
+    async for field, item in _stream_merged(raw):
+        if field is not None:
+            yield field, item
+
+
+async def extract_features(raw):
+    data = {'actions': [], 'info_': []}
+    complete = False
+    async for field, item in _stream_merged(raw):
+        if field is None:
+            complete = True
+        else:
+            data[field].append(item)
+    # empty lists are a valid answer; None means no region produced a tool call
+    return _construct_features(data) if complete else None
+
+async def extract_features_batch(contents):
+    return await asyncio.gather(*(extract_features(raw) for raw in contents))
 
 if __name__ == '__main__':
-    with open("src/dummy-data/dashboard.html") as file:
-        features = extract_features(file)
+    with open("src/dummy-data/dashboard.html", 'rb') as file:
+        features = asyncio.run(extract_features(file.read()))
 
         if features:
             print('\nAction\n')
@@ -1,7 +1,9 @@
+import os
 from typing import List
 
+from langchain_core.runnables import RunnableLambda
+from langchain_core.utils.function_calling import convert_to_openai_tool
 from pydantic import BaseModel, Field
-from trustcall import create_extractor
 
 from src.llm import model
 
@@ -58,10 +60,46 @@ class Features(BaseModel):
         '''
     )
 
-bmodel = create_extractor(
-    llm=model,
-    tools=[Features],
-    tool_choice='Features'
-)
+
+class ActionsOnly(BaseModel):
+    """
+    The interactive Actions provided by the rendered HTML page.
+    """
+    actions: List[Action] = Field(
+        description='''
+            A list of all interactive actions available on the rendered webpage. 
+            All components of a single form or goal must be combined into one action.
+        '''
+    )
+
+class InfoOnly(BaseModel):
+    """
+    The read-only Information provided by the rendered HTML page.
+    """
+    info_: List[Info] = Field(
+        description='''
+            A list of all read-only information displayed on the rendered webpage. 
+            **MUST NOT** include any element or text that is part of an already identified Action.
+        '''
+    )
+
+# derived once per process; every request reuses the same tool definitions
+ACTIONS_TOOL = convert_to_openai_tool(ActionsOnly)
+INFO_TOOL = convert_to_openai_tool(InfoOnly)
+
+if os.environ.get('STRICT') == '1':
+    # trustcall re-validates and retries on schema failures; kept for offline regression runs.
+    # Imported here because it pulls in langgraph, which every worker would otherwise load at boot.
+    from trustcall import create_extractor
+
+    bmodel = create_extractor(
+        llm=model,
+        tools=[Features],
+        tool_choice='Features'
+    ) | RunnableLambda(lambda result: result['responses'][0] if result['responses'] else None)
+
+# raw tool-call bindings, streamed by the driver so it can stop as soon as each call closes
+amodel = model.bind_tools([ACTIONS_TOOL], tool_choice='ActionsOnly')
+imodel = model.bind_tools([INFO_TOOL], tool_choice='InfoOnly')
 
 # Created By Amit Mahapatra
\ No newline at end of file
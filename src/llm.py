@@ -1,16 +1,63 @@
 import os
+from functools import lru_cache
 
+import httpx
 from langchain_ollama import ChatOllama
 from dotenv import load_dotenv
 
 load_dotenv()
 
+MODEL_NAME = 'gpt-oss:120b'
+
 model = ChatOllama(
     base_url='https://ollama.com',
-    model='gpt-oss:120b',
+    model=MODEL_NAME,
     lc_secrets={
         'headers' : {'Authorization': 'Bearer ' + os.environ.get('OLLAMA_API_KEY')}
+    },
+    # one pooled async HTTP client is shared by every runnable built from this model
+    async_client_kwargs={
+        'timeout': 120,
+        'limits': httpx.Limits(max_connections=64, max_keepalive_connections=64)
     }
 )
 
+
+@lru_cache(maxsize=1)
+def get_tokenizer():
+    """
+    Loads the gpt-oss tokenizer once per process, preferring the local Hugging Face
+    cache. Returns None when it cannot be loaded (e.g. no network and nothing cached);
+    the None is cached too, so callers fall back to an estimate instead of retrying
+    the download on every request.
+    """
+    # transformers is imported lazily so importing this module stays cheap
+    from transformers import AutoTokenizer
+
+    try:
+        return AutoTokenizer.from_pretrained("openai/gpt-oss-120b", use_fast=True, local_files_only=True)
+    except OSError:
+        pass
+    # the Hub client retries unreachable hosts for ~45 s, so probe first with a short timeout
+    if not _hub_reachable():
+        return None
+    try:
+        return AutoTokenizer.from_pretrained("openai/gpt-oss-120b", use_fast=True)
+    except OSError:
+        return None
+
+
+def _hub_reachable():
+    if os.environ.get('HF_HUB_OFFLINE', '').lower() in ('1', 'true', 'yes'):
+        return False
+    try:
+        httpx.head(os.environ.get('HF_ENDPOINT', 'https://huggingface.co'), timeout=3)
+    except httpx.HTTPError:
+        return False
+    return True
+
+
+async def close_model():
+    await model._async_client.close()
+
 # Created By Amit Mahapatra
\ No newline at end of file